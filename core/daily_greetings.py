@@ -4,16 +4,21 @@ import asyncio
 import datetime
 import logging
 import random
-from typing import Dict, Any, Set, List
+from operator import itemgetter
+from typing import Dict, Any, FrozenSet, Optional, Set, Tuple
 
 from ..utils.message_manager import MessageManager
 from ..utils.user_manager import UserManager
 from ..utils.task_manager import TaskManager
 from ..utils.config_manager import ConfigManager
+from ..utils.time_window import in_window, next_window_start
 
 # 配置日志
 logger = logging.getLogger("daily_greetings")
 
+# 从用户记录中一次取出会话ID和统一消息来源
+_REC_FIELDS = itemgetter("conversation_id", "unified_msg_origin")
+
 
 class DailyGreetings:
     """每日问候类，负责在特定时间发送问候消息"""
@@ -66,9 +71,14 @@ class DailyGreetings:
             "请以舒适的语气，简短地向用户道晚安，可以表达希望用户做个好梦",
         ]
 
-        # 跟踪用户今日已收到的问候
-        self.today_morning_users = set()
-        self.today_night_users = set()
+        # 跟踪用户今日已收到的问候: (问候类型, 用户ID)
+        self.greeted_today: Set[Tuple[str, str]] = set()
+
+        # 问候时间段内两次挑选用户之间的间隔（秒）
+        self.greeting_recheck_seconds = 60
+
+        # 每种问候下一次检查的时刻: 问候类型 -> 时刻
+        self._next_greeting_check: Dict[str, datetime.datetime] = {}
 
         # 记录最近一次检查的日期，用于重置状态
         self.last_check_date = datetime.datetime.now().date()
@@ -106,48 +116,64 @@ class DailyGreetings:
             self.greeting_task = None
 
     async def _greeting_check_loop(self):
-        """定时检查是否需要发送问候消息的循环"""
+        """休眠到最近一次问候检查时刻，在问候时间段内定期挑选用户发送问候的循环"""
         try:
+            windows: Dict[str, Tuple[int, int]] = {}
+            if self.morning_enabled:
+                windows["morning"] = (self.morning_start_hour, self.morning_end_hour)
+            if self.night_enabled:
+                windows["night"] = (self.night_start_hour, self.night_end_hour)
+
+            if not windows:
+                logger.info("早安与晚安问候均已禁用，退出每日问候循环")
+                return
+
+            # 启动时已处于时间段内的问候立即检查，否则等到时间段开始
+            now = datetime.datetime.now()
+            next_check = self._next_greeting_check
+            next_check.clear()
+            for greeting_type, (start_hour, end_hour) in windows.items():
+                next_check[greeting_type] = next_window_start(
+                    start_hour, end_hour, now
+                )
+
             while True:
-                # 检查当前时间
+                greeting_type = min(next_check, key=next_check.get)
+                due = next_check[greeting_type]
+                delay = (due - datetime.datetime.now()).total_seconds()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
                 now = datetime.datetime.now()
-                current_date = now.date()
-                current_hour = now.hour
+                # 提前唤醒时重新休眠，每个检查时刻只处理一次
+                if now < due:
+                    continue
 
                 # 如果日期变了，重置状态
+                current_date = now.date()
                 if current_date != self.last_check_date:
-                    logger.info(f"日期已变更为 {current_date}，重置每日问候状态")
-                    self.today_morning_users.clear()
-                    self.today_night_users.clear()
+                    logger.info("日期已变更为 %s，重置每日问候状态", current_date)
+                    self.greeted_today.clear()
+                    self.message_manager.clear_persona_cache()
                     self.last_check_date = current_date
 
-                # 1. 检查是否在早晨问候时间段
-                if (
-                    self.morning_enabled
-                    and self.morning_start_hour <= current_hour < self.morning_end_hour
-                ):
-                    await self._check_greeting_time("morning")
+                # 时间段内每轮挑选一批今日尚未收到该问候的用户
+                start_hour, end_hour = windows[greeting_type]
+                if in_window(start_hour, end_hour, now.hour):
+                    await self._check_greeting_time(greeting_type)
 
-                # 2. 检查是否在晚安问候时间段
-                night_end = self.night_end_hour
-                if night_end == 24:
-                    night_end = 0  # 处理跨日的情况
-
-                if self.night_enabled:
-                    if (
-                        self.night_start_hour <= current_hour < 24
-                        or 0 <= current_hour < night_end
-                    ):
-                        await self._check_greeting_time("night")
-
-                # 每分钟检查一次
-                await asyncio.sleep(60)
+                # 时间段内按间隔重新检查，时间段结束后顺延到下一次开始时刻
+                next_check[greeting_type] = next_window_start(
+                    start_hour,
+                    end_hour,
+                    now + datetime.timedelta(seconds=self.greeting_recheck_seconds),
+                )
 
         except asyncio.CancelledError:
             logger.info("每日问候检查循环已取消")
             raise
         except Exception as e:
-            logger.error(f"每日问候检查循环发生错误: {str(e)}")
+            logger.error("每日问候检查循环发生错误: %s", e)
 
     async def _check_greeting_time(self, greeting_type: str):
         """检查是否需要发送问候消息
@@ -156,12 +182,10 @@ class DailyGreetings:
             greeting_type: 问候类型，"morning" 或 "night"
         """
         try:
-            # 确定使用哪个已发送集合和提示词
-            users_set = (
-                self.today_morning_users
-                if greeting_type == "morning"
-                else self.today_night_users
-            )
+            # 确定今日已收到该问候的用户和使用的提示词
+            users_set = {
+                user_id for kind, user_id in self.greeted_today if kind == greeting_type
+            }
             prompts = (
                 self.morning_prompts
                 if greeting_type == "morning"
@@ -169,8 +193,13 @@ class DailyGreetings:
             )
             greeting_name = "早安" if greeting_type == "morning" else "晚安"
 
+            # 本次调度使用同一份白名单快照
+            whitelist = self.user_manager.whitelist_snapshot()
+
             # 获取所有符合条件的用户
-            eligible_users = self.user_manager.get_eligible_users(users_set)
+            eligible_users = self.user_manager.get_eligible_users(
+                users_set, whitelist
+            )
 
             if not eligible_users:
                 return
@@ -180,29 +209,41 @@ class DailyGreetings:
                 eligible_users, self.user_selection_ratio, self.min_selected_users
             )
 
-            for user_id, record in selected_users:
-                # 创建异步任务发送问候消息
-                task_id = f"{greeting_type}_{user_id}_{int(datetime.datetime.now().timestamp())}"
-
-                # 使用任务管理器调度任务
-                await self.task_manager.schedule_task(
-                    task_id=task_id,
-                    coroutine_func=self._send_greeting_message,
-                    random_delay=True,
-                    min_delay=1,
-                    max_delay=40,  # 更长的延迟时间，让消息分散发送
-                    user_id=user_id,
-                    conversation_id=record["conversation_id"],
-                    unified_msg_origin=record["unified_msg_origin"],
-                    greeting_type=greeting_name,
-                    prompts=prompts,
+            # 一次性为所有选中用户抽取提示词
+            chosen_prompts = random.choices(prompts, k=len(selected_users))
+
+            jobs = []
+            for (user_id, record), prompt in zip(selected_users, chosen_prompts):
+                conversation_id, unified_msg_origin = _REC_FIELDS(record)
+                jobs.append(
+                    {
+                        "user_id": user_id,
+                        "conversation_id": conversation_id,
+                        "unified_msg_origin": unified_msg_origin,
+                        "greeting_type": greeting_name,
+                        "prompt": prompt,
+                        "whitelist": whitelist,
+                    }
                 )
 
-                # 将用户添加到今日已发送集合
-                users_set.add(user_id)
+            # 整批用户由一个监督任务调度，消息在延迟时间内分散发送；
+            # 时间段内每轮检查各自成批，任务ID带上时刻以免覆盖上一批的引用
+            batch_time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            await self.task_manager.schedule_batch(
+                task_id=f"greeting_{greeting_type}_{batch_time}",
+                coroutine_func=self._send_greeting_message,
+                jobs=jobs,
+                min_delay=1,
+                max_delay=40,  # 更长的延迟时间，让消息分散发送
+            )
+
+            # 将用户添加到今日已发送集合
+            self.greeted_today.update(
+                (greeting_type, user_id) for user_id, _ in selected_users
+            )
 
         except Exception as e:
-            logger.error(f"检查{greeting_type}问候任务时发生错误: {str(e)}")
+            logger.error("检查%s问候任务时发生错误: %s", greeting_type, e)
 
     async def _send_greeting_message(
         self,
@@ -210,7 +251,8 @@ class DailyGreetings:
         conversation_id: str,
         unified_msg_origin: str,
         greeting_type: str,
-        prompts: List[str],
+        prompt: str,
+        whitelist: Optional[FrozenSet[str]] = None,
     ):
         """发送问候消息
 
@@ -219,11 +261,12 @@ class DailyGreetings:
             conversation_id: 会话ID
             unified_msg_origin: 统一消息来源
             greeting_type: 问候类型描述
-            prompts: 提示词列表
+            prompt: 调度时选定的提示词
+            whitelist: 调度时的白名单快照，None表示未启用白名单
         """
-        # 再次检查用户是否在白名单中
-        if not self.user_manager.is_user_in_whitelist(user_id):
-            logger.info(f"用户 {user_id} 不在白名单中，取消发送{greeting_type}消息")
+        # 按调度时的白名单快照再次检查用户
+        if whitelist is not None and user_id not in whitelist:
+            logger.info("用户 %s 不在白名单中，取消发送%s消息", user_id, greeting_type)
             return
 
         # 确定当前时间段
@@ -242,7 +285,7 @@ class DailyGreetings:
             user_id=user_id,
             conversation_id=conversation_id,
             unified_msg_origin=unified_msg_origin,
-            prompts=prompts,
+            prompt=prompt,
             message_type=greeting_type,
             time_period=time_period,
         )
@@ -2,17 +2,19 @@
 
 import asyncio
 import datetime
+import heapq
 import logging
 import random
-from typing import Dict, Any, Set, List, Optional
+import time
+from typing import Dict, Any, Set, List, Optional, Tuple
 
 from astrbot.api.event import AstrMessageEvent
 from astrbot.api.provider import ProviderRequest
 
 from ..utils.message_manager import MessageManager
 from ..utils.user_manager import UserManager
-from ..utils.task_manager import TaskManager
 from ..utils.config_manager import ConfigManager
+from ..utils.expiring_set import ExpiringSet
 
 # 配置日志
 logger = logging.getLogger("initiative_dialogue_core")
@@ -45,6 +47,7 @@ class InitiativeDialogueCore:
         self.time_limit_enabled = core_config.get("time_limit_enabled", True)
         self.activity_start_hour = core_config.get("activity_start_hour", 8)
         self.activity_end_hour = core_config.get("activity_end_hour", 22)
+        self.max_consecutive_messages = core_config.get("max_consecutive_messages", 3)
 
         # 白名单配置
         whitelist_config = core_config.get("whitelist", {})
@@ -62,6 +65,15 @@ class InitiativeDialogueCore:
             ],
         )
 
+        # 小时 -> 时间段描述，发送时直接按小时查表
+        self._hour_to_period = tuple(
+            "早上" if 5 <= h < 12
+            else "下午" if 12 <= h < 18
+            else "晚上" if 18 <= h < 22
+            else "深夜"
+            for h in range(24)
+        )
+
         # 回复检测配置
         self.initiative_response_keywords = core_config.get(
             "initiative_response_keywords",
@@ -85,15 +97,48 @@ class InitiativeDialogueCore:
         self.last_initiative_messages = (
             {}
         )  # user_id -> {"timestamp": datetime, "conversation_id": str, "unified_msg_origin": str}
-        self.users_received_initiative = set()  # 记录已接收过主动消息的用户ID
+        # 记录已接收过主动消息的用户ID，超过可能回复的时间后自动移除
+        self.users_received_initiative = ExpiringSet(
+            self._received_initiative_ttl()
+        )
+
+        # 本模块独立的随机数生成器，不与其他模块共用全局随机状态
+        self._rng = random.Random()
+
+        # 数据自上次保存后是否有变更
+        self._dirty = False
 
         # 检查任务引用
         self.inactive_check_task = None
 
+        # 是否已请求停止检查循环
+        self._stop = False
+
+        # 最长检查间隔（秒）
+        self.check_interval_seconds = 30
+
+        # 两次主动消息之间的最短间隔（秒）
+        self.min_initiative_interval_seconds = 6 * 3600
+
+        # 到期堆: (需要检查的单调时钟时间, 用户ID, 序号)，序号用于识别过期条目
+        self._due_heap: List[Tuple[float, str, int]] = []
+        self._due_seq: Dict[str, int] = {}
+        self._heap_seq = 0
+
+        # 待发送堆: (发送时间的单调时钟值, 序号, 用户ID, 会话ID, 统一消息来源)
+        self._send_heap: List[Tuple[float, int, str, str, str]] = []
+        # 用户ID -> (待发送条目的序号, 发送时间的单调时钟值)，
+        # 用户回复时移除该项，堆中条目即作废
+        self._pending_sends: Dict[str, Tuple[int, float]] = {}
+        self._send_seq = 0
+        self._send_wake = asyncio.Event()
+        self.dispatcher_task = None
+        # 正在发送中的消息任务，保留引用直到完成
+        self._inflight_sends: Set[asyncio.Task] = set()
+
         # 初始化共享组件
         self.message_manager = MessageManager(parent)
         self.user_manager = UserManager(parent)
-        self.task_manager = TaskManager(parent)
 
         logger.info(
             f"主动对话核心初始化完成，不活跃时间阈值：{self.inactive_time_seconds}秒"
@@ -111,6 +156,23 @@ class InitiativeDialogueCore:
             "users_received_initiative": self.users_received_initiative,
         }
 
+    def _received_initiative_ttl(self) -> float:
+        """计算已接收主动消息标记的保留时间（秒）
+
+        用户在此期间没有回复时，之后的消息不再视为对主动消息的回复。
+
+        Returns:
+            float: 保留时间（秒）
+        """
+        return (
+            self.inactive_time_seconds
+            + self.max_response_delay_seconds * max(1, self.max_consecutive_messages)
+        )
+
+    def mark_dirty(self) -> None:
+        """标记数据已变更，下次定期保存时写入存储"""
+        self._dirty = True
+
     def set_data(
         self,
         user_records: Dict[str, Any],
@@ -126,12 +188,16 @@ class InitiativeDialogueCore:
         """
         self.user_records = user_records
         self.last_initiative_messages = last_initiative_messages
-        self.users_received_initiative = users_received_initiative
+        self.users_received_initiative = ExpiringSet(
+            self._received_initiative_ttl()
+        )
+        self.users_received_initiative.update(users_received_initiative)
+        self._rebuild_due_heap()
 
         logger.info(
             f"已加载用户数据，共有 {len(user_records)} 条用户记录，"
             f"{len(last_initiative_messages)} 条主动消息记录，"
-            f"{len(users_received_initiative)} 个用户已接收主动消息"
+            f"{len(self.users_received_initiative)} 个用户已接收主动消息"
         )
 
     async def start_checking_inactive_conversations(self) -> None:
@@ -141,12 +207,15 @@ class InitiativeDialogueCore:
             return
 
         logger.info("启动检查不活跃对话任务")
+        self._stop = False
         self.inactive_check_task = asyncio.create_task(
             self._check_inactive_conversations_loop()
         )
+        self.dispatcher_task = asyncio.create_task(self._dispatch_loop())
 
     async def stop_checking_inactive_conversations(self) -> None:
         """停止检查不活跃对话的任务"""
+        self._stop = True
         if self.inactive_check_task is not None and not self.inactive_check_task.done():
             self.inactive_check_task.cancel()
             try:
@@ -157,65 +226,263 @@ class InitiativeDialogueCore:
             self.inactive_check_task = None
             logger.info("不活跃对话检查任务已停止")
 
+        if self.dispatcher_task is not None and not self.dispatcher_task.done():
+            self.dispatcher_task.cancel()
+            try:
+                await self.dispatcher_task
+            except asyncio.CancelledError:
+                pass
+
+            self.dispatcher_task = None
+            logger.info("主动消息发送调度已停止")
+
+        # cancel() 不会同步触发完成回调，可以直接遍历集合
+        pending = [task for task in self._inflight_sends if not task.done()]
+        for task in pending:
+            task.cancel()
+
+        # 一次等待所有发送任务完成取消
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.info(f"已取消 {len(pending)} 个发送中的主动消息")
+
+    def _push_due(self, user_id: str, deadline: float) -> None:
+        """将用户加入到期堆，旧的堆条目会因序号不匹配而失效
+
+        Args:
+            user_id: 用户ID
+            deadline: 需要检查该用户的单调时钟时间
+        """
+        seq = self._heap_seq
+        self._heap_seq += 1
+        self._due_seq[user_id] = seq
+        heapq.heappush(self._due_heap, (deadline, user_id, seq))
+
+    def _rebuild_due_heap(self) -> None:
+        """根据当前用户记录重建到期堆
+
+        记录中保存的是墙上时间，按与当前时间的差值换算为单调时钟的到期时间。
+        """
+        self._due_heap = []
+        self._due_seq = {}
+        wall_now = datetime.datetime.now()
+        mono_now = time.monotonic()
+        for user_id, record in self.user_records.items():
+            last_active = record.get("timestamp")
+            if isinstance(last_active, datetime.datetime):
+                inactive_for = (wall_now - last_active).total_seconds()
+                self._push_due(
+                    user_id, mono_now - inactive_for + self.inactive_time_seconds
+                )
+
     async def _check_inactive_conversations_loop(self) -> None:
-        """定期检查不活跃对话的循环"""
-        try:
-            while True:
-                # 每30秒检查一次
-                await asyncio.sleep(30)
-
-                # 如果启用了时间限制，检查当前是否在活动时间范围内
-                if self.time_limit_enabled:
-                    current_hour = datetime.datetime.now().hour
-                    if not (
-                        self.activity_start_hour
-                        <= current_hour
-                        < self.activity_end_hour
+        """定期检查不活跃对话的循环，出错后在同一个任务中稍后继续检查"""
+        while not self._stop:
+            try:
+                while True:
+                    # 休眠到最早的到期时间，最长不超过检查间隔；
+                    # 堆顶已到期说明上一轮因时间限制被跳过，此时按检查间隔休眠
+                    wait = self.check_interval_seconds
+                    if self._due_heap:
+                        remaining = self._due_heap[0][0] - time.monotonic()
+                        if remaining > 0:
+                            wait = min(wait, max(1, remaining))
+                    await asyncio.sleep(wait)
+
+                    # 获取当前时间，不活跃时间使用单调时钟计算
+                    now = datetime.datetime.now()
+                    now_mono = time.monotonic()
+
+                    # 如果启用了时间限制，检查当前是否在活动时间范围内
+                    if self.time_limit_enabled and not (
+                        self.activity_start_hour <= now.hour < self.activity_end_hour
                     ):
                         # 不在活动时间范围内，跳过本次检查
                         continue
 
-                # 获取当前时间
-                now = datetime.datetime.now()
+                    # 本轮检查中不变的值提前取出为局部变量
+                    max_delay = int(self.max_response_delay_seconds / 60)
+                    check_interval = self.check_interval_seconds
+                    recheck_at = now_mono + check_interval
+                    whitelist_enabled = self.whitelist_enabled
+                    whitelist_users = self.whitelist_users
+                    pending_sends = self._pending_sends
+                    due_heap = self._due_heap
+                    user_records = self.user_records
+                    due_seq = self._due_seq
+
+                    # 只处理已到期的用户，过期的堆条目直接丢弃
+                    while due_heap and due_heap[0][0] <= now_mono:
+                        _, user_id, seq = heapq.heappop(due_heap)
+                        # 大多数出堆条目是用户再次发言后留下的过期条目，先用序号排除
+                        if due_seq.get(user_id) != seq:
+                            continue
+                        record = user_records.get(user_id)
+                        if record is None:
+                            due_seq.pop(user_id, None)
+                            continue
+
+                        # 如果启用了白名单且用户不在白名单中，不再检查该用户
+                        if whitelist_enabled and user_id not in whitelist_users:
+                            due_seq.pop(user_id, None)
+                            continue
+
+                        # 用户仍未活跃，按其下一次可能需要发送的时间重新入堆
+                        # 已有待发送的消息时不重复安排，发送时间过后再检查
+                        pending = pending_sends.get(user_id)
+                        if pending is not None:
+                            self._push_due(
+                                user_id, max(pending[1], now_mono) + check_interval
+                            )
+                            continue
+
+                        # 距离上次主动消息未满最短间隔时，到间隔结束时再检查
+                        cooldown = self._initiative_cooldown_remaining(user_id, now)
+                        if cooldown > 0:
+                            self._push_due(user_id, now_mono + cooldown)
+                            continue
+
+                        # 检查是否需要发送主动消息，未抽中时下一个检查间隔后再试
+                        if not await self._should_send_initiative_message(user_id):
+                            self._push_due(user_id, recheck_at)
+                            continue
+
+                        # 计算随机延迟时间，增加自然感
+                        delay_minutes = self._rng.randrange(max(max_delay, 0) + 1)
+                        fire_at = now_mono + delay_minutes * 60
+                        self._schedule_send(
+                            user_id,
+                            record["conversation_id"],
+                            record["unified_msg_origin"],
+                            fire_at,
+                        )
+                        self._push_due(user_id, fire_at + check_interval)
+                        logger.info(
+                            "已安排向用户 %s 发送主动消息，将在 %s 分钟后执行",
+                            user_id,
+                            delay_minutes,
+                        )
 
-                # 遍历所有用户记录，检查不活跃状态
-                for user_id, record in list(self.user_records.items()):
-                    # 如果启用了白名单且用户不在白名单中，跳过
-                    if self.whitelist_enabled and user_id not in self.whitelist_users:
-                        continue
+            except asyncio.CancelledError:
+                logger.info("不活跃对话检查循环已取消")
+                raise
+            except Exception as e:
+                logger.error(f"检查不活跃对话时发生错误: {str(e)}，5秒后继续检查")
+                await asyncio.sleep(5)
 
-                    # 检查用户最后活跃时间
-                    last_active = record.get("timestamp")
-                    if not last_active:
-                        continue
+    def _schedule_send(
+        self,
+        user_id: str,
+        conversation_id: str,
+        unified_msg_origin: str,
+        fire_at: float,
+    ) -> None:
+        """将一条主动消息加入待发送堆，并唤醒调度协程
 
-                    # 计算不活跃时间（秒）
-                    inactive_seconds = (now - last_active).total_seconds()
-
-                    # 如果超过阈值，考虑发送主动消息
-                    if inactive_seconds >= self.inactive_time_seconds:
-                        # 检查是否需要发送主动消息
-                        if await self._should_send_initiative_message(user_id):
-                            # 为用户创建发送主动消息的任务
-                            task_id = f"initiative_{user_id}_{int(now.timestamp())}"
-
-                            # 计算随机延迟时间，增加自然感
-                            await self.task_manager.schedule_task(
-                                task_id=task_id,
-                                coroutine_func=self._send_initiative_message,
-                                random_delay=True,
-                                min_delay=0,
-                                max_delay=int(self.max_response_delay_seconds / 60),
-                                user_id=user_id,
-                                conversation_id=record["conversation_id"],
-                                unified_msg_origin=record["unified_msg_origin"],
-                            )
+        Args:
+            user_id: 用户ID
+            conversation_id: 会话ID
+            unified_msg_origin: 统一消息来源
+            fire_at: 发送时间的单调时钟值
+        """
+        seq = self._send_seq
+        self._send_seq += 1
+        self._pending_sends[user_id] = (seq, fire_at)
+        heapq.heappush(
+            self._send_heap,
+            (fire_at, seq, user_id, conversation_id, unified_msg_origin),
+        )
+        self._send_wake.set()
+
+    def _cancel_pending_send(self, user_id: str) -> bool:
+        """作废用户尚未发送的主动消息，堆中的条目在出堆时被丢弃
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            bool: 是否存在被作废的待发送消息
+        """
+        return self._pending_sends.pop(user_id, None) is not None
+
+    async def _dispatch_loop(self) -> None:
+        """按发送时间依次发出主动消息的调度循环，所有待发送消息共用这一个协程"""
+        send_heap = self._send_heap
+        wake = self._send_wake
+        try:
+            while True:
+                if not send_heap:
+                    wake.clear()
+                    await wake.wait()
+                    continue
+
+                # 堆顶未到发送时间时休眠，有新条目加入时提前唤醒
+                wait = send_heap[0][0] - time.monotonic()
+                if wait > 0:
+                    wake.clear()
+                    try:
+                        await asyncio.wait_for(wake.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                _, seq, user_id, conversation_id, unified_msg_origin = heapq.heappop(
+                    send_heap
+                )
+
+                # 用户已回复或已重新安排，该条目作废
+                pending = self._pending_sends.get(user_id)
+                if pending is None or pending[0] != seq:
+                    continue
+                del self._pending_sends[user_id]
+
+                task = asyncio.create_task(
+                    self._run_initiative_send(
+                        user_id, conversation_id, unified_msg_origin
+                    )
+                )
+                self._inflight_sends.add(task)
+                task.add_done_callback(self._inflight_sends.discard)
 
         except asyncio.CancelledError:
-            logger.info("不活跃对话检查循环已取消")
+            logger.info("主动消息发送调度循环已取消")
             raise
+
+    async def _run_initiative_send(
+        self, user_id: str, conversation_id: str, unified_msg_origin: str
+    ) -> None:
+        """发送一条主动消息，出错时只记录日志
+
+        Args:
+            user_id: 用户ID
+            conversation_id: 会话ID
+            unified_msg_origin: 统一消息来源
+        """
+        try:
+            await self._send_initiative_message(
+                user_id, conversation_id, unified_msg_origin
+            )
         except Exception as e:
-            logger.error(f"检查不活跃对话时发生错误: {str(e)}")
+            logger.error(f"向用户 {user_id} 发送主动消息时出错: {str(e)}")
+
+    def _initiative_cooldown_remaining(
+        self, user_id: str, now: datetime.datetime
+    ) -> float:
+        """计算距离可以再次向用户发送主动消息还需等待的时间
+
+        Args:
+            user_id: 用户ID
+            now: 当前时间
+
+        Returns:
+            float: 剩余等待秒数，无需等待时为0
+        """
+        last_message = self.last_initiative_messages.get(user_id)
+        last_time = last_message.get("timestamp") if last_message else None
+        if not last_time:
+            return 0.0
+        elapsed = (now - last_time).total_seconds()
+        return max(0.0, self.min_initiative_interval_seconds - elapsed)
 
     async def _should_send_initiative_message(self, user_id: str) -> bool:
         """判断是否应该向指定用户发送主动消息
@@ -240,17 +507,17 @@ class InitiativeDialogueCore:
 
                 # 根据距离上次发送的时间计算发送概率
                 # 时间越长，概率越高：6小时内不发送，6-12小时30%概率，12-24小时60%概率，24小时以上90%概率
-                if hours_since_last < 6:
+                if hours_since_last < self.min_initiative_interval_seconds / 3600:
                     return False
                 elif hours_since_last < 12:
-                    return random.random() < 0.3
+                    return self._rng.random() < 0.3
                 elif hours_since_last < 24:
-                    return random.random() < 0.6
+                    return self._rng.random() < 0.6
                 else:
-                    return random.random() < 0.9
+                    return self._rng.random() < 0.9
         else:
             # 如果是首次发送主动消息，50%概率发送
-            return random.random() < 0.5
+            return self._rng.random() < 0.5
 
     async def _send_initiative_message(
         self, user_id: str, conversation_id: str, unified_msg_origin: str
@@ -267,30 +534,22 @@ class InitiativeDialogueCore:
             logger.info(f"用户 {user_id} 不在白名单中，取消发送主动消息")
             return
 
-        # 获取当前时间段，用于调整消息内容
-        current_hour = datetime.datetime.now().hour
-        if 5 <= current_hour < 12:
-            time_period = "早上"
-        elif 12 <= current_hour < 18:
-            time_period = "下午"
-        elif 18 <= current_hour < 22:
-            time_period = "晚上"
-        else:
-            time_period = "深夜"
+        # 获取当前时间段，用于调整消息内容；本次发送只取一次当前时间
+        now = datetime.datetime.now()
+        time_period = self._hour_to_period[now.hour]
 
         # 使用消息管理器发送主动消息
         success = await self.message_manager.generate_and_send_message(
             user_id=user_id,
             conversation_id=conversation_id,
             unified_msg_origin=unified_msg_origin,
-            prompts=self.initiative_prompts,
+            prompt=self._rng.choice(self.initiative_prompts),
             message_type="主动消息",
             time_period=time_period,
         )
 
         if success:
             # 更新主动消息记录
-            now = datetime.datetime.now()
             self.last_initiative_messages[user_id] = {
                 "timestamp": now,
                 "conversation_id": conversation_id,
@@ -299,6 +558,7 @@ class InitiativeDialogueCore:
 
             # 标记用户已接收主动消息
             self.users_received_initiative.add(user_id)
+            self.mark_dirty()
 
             logger.info(f"已向用户 {user_id} 发送主动消息")
 
@@ -319,17 +579,26 @@ class InitiativeDialogueCore:
 
         # 更新用户记录
         now = datetime.datetime.now()
+        now_mono = time.monotonic()
         self.user_records[user_id] = {
             "timestamp": now,
             "conversation_id": conversation_id,
             "unified_msg_origin": unified_msg_origin,
         }
 
+        # 在不活跃阈值到达时再检查该用户
+        self._push_due(user_id, now_mono + self.inactive_time_seconds)
+        self.mark_dirty()
+
+        # 用户已主动发言，作废该用户尚未发送的主动消息
+        if self._cancel_pending_send(user_id):
+            logger.info(f"用户 {user_id} 已发言，取消待发送的主动消息")
+
         # 记录日志（仅在调试模式下）
         logger.debug(f"已更新用户 {user_id} 的活跃状态，最后活跃时间：{now}")
 
     def modify_llm_request_for_initiative_response(
-        self, event: AstrMessageEvent, user_id: str, req: ProviderRequest
+        self, user_id: str, req: ProviderRequest
     ) -> None:
         """修改LLM请求以适应对主动消息的回复
 
@@ -338,7 +607,8 @@ class InitiativeDialogueCore:
             req: LLM请求对象
         """
         # 检查用户是否最近收到过主动消息
-        if user_id not in self.users_received_initiative:
+        received = self.users_received_initiative
+        if user_id not in received:
             return
 
         # 获取用户输入文本
@@ -366,7 +636,8 @@ class InitiativeDialogueCore:
                 req.system_prompt = f"{current_system_prompt}\n\n{additional_context}"
 
             # 移除用户标记，表示已处理该回复
-            self.users_received_initiative.discard(user_id)
+            received.discard(user_id)
+            self.mark_dirty()
 
             logger.debug(
                 f"已识别用户 {user_id} 的消息为对主动消息的回复，已调整系统提示词"
@@ -2,17 +2,26 @@
 
 import asyncio
 import datetime
+import heapq
 import logging
-from typing import Dict, Any, Set
+import math
+import random
+import time
+from typing import Dict, Any, List, Optional, Set, Tuple
 
 from ..utils.message_manager import MessageManager
 from ..utils.user_manager import UserManager
-from ..utils.task_manager import TaskManager
 from ..utils.config_manager import ConfigManager
+from ..utils.time_window import in_window, next_window_start
 
 # 配置日志
 logger = logging.getLogger("random_daily_activities")
 
+# 小时 -> 日常分享时间段，5-12点早上，12-18点下午，18-23点晚上，其余为深夜
+PERIOD_BY_HOUR = (
+    ("深夜",) * 5 + ("早上",) * 7 + ("下午",) * 6 + ("晚上",) * 5 + ("深夜",) * 1
+)
+
 
 class RandomDailyActivities:
     """随机日常类，负责在特定时间段发送不同类型的日常消息"""
@@ -94,18 +103,52 @@ class RandomDailyActivities:
         # 跟踪用户今日已收到的消息
         self.today_lunch_users = set()
         self.today_dinner_users = set()
-        self.last_sharing_time = {}  # 用户ID -> 上次分享时间
+        # 已安排但尚未发送完成的用餐消息，用餐类型 -> 用户ID集合；
+        # 跨日期重置后仍在等待发送的用户不会被再次选中
+        self._pending_meal_users: Dict[str, Set[str]] = {
+            "lunch": set(),
+            "dinner": set(),
+        }
+        self.last_sharing_time: Dict[str, float] = {}  # 用户ID -> 上次分享的单调时钟时间
+
+        # 日常分享堆: (下次分享的单调时钟时间, 用户ID)，每个已知用户恰有一个条目
+        self._sharing_heap: List[Tuple[float, str]] = []
+        self._sharing_known: Set[str] = set()
+        # 上次同步时的用户记录对象及其大小，用于判断是否有新用户
+        self._synced_records = None
+        self._synced_count = 0
+        # 日常分享堆顶的到期时间（单调时钟），在此之前无需检查分享
+        self._next_sharing_scan_after = 0.0
 
         # 记录最近一次检查的日期，用于重置状态
         self.last_check_date = datetime.datetime.now().date()
 
+        # 用餐时间段内两次挑选用户之间的间隔（秒），每次挑选的比例按此间隔设定
+        self.meal_recheck_seconds = 10
+        # 日常分享概率对应的检查间隔（秒），同时是发现新用户的最长等待时间
+        self.sharing_check_seconds = 10
+
+        # 事件堆: (触发时间戳, 序号, 事件类型, 参数)，事件类型为 "lunch"、"dinner"、
+        # "sharing" 或 "send"，"send" 事件的参数为发送消息所需的关键字参数
+        self._event_heap: List[Tuple[float, int, str, Optional[Dict[str, Any]]]] = []
+        self._event_seq = 0
+        self._wake = asyncio.Event()
+
+        # 正在发送中的消息任务，保留引用直到完成
+        self._send_tasks: Set[asyncio.Task] = set()
+
         # 主要任务引用
         self.daily_task = None
 
         # 初始化共享组件
         self.message_manager = MessageManager(parent)
         self.user_manager = UserManager(parent)
-        self.task_manager = TaskManager(parent)
+
+        # 提示词固定不变，预先生成发送时使用的完整提示词
+        self.message_manager.preformat_prompts(self.lunch_prompts)
+        self.message_manager.preformat_prompts(self.dinner_prompts)
+        for period, period_prompts in self.time_period_prompts.items():
+            self.message_manager.preformat_prompts(period_prompts, period)
 
         logger.info(
             f"随机日常模块初始化完成，状态：{'启用' if self.enabled else '禁用'}"
@@ -121,6 +164,9 @@ class RandomDailyActivities:
             logger.warning("随机日常任务已经在运行中")
             return
 
+        # 重新启动时人格配置可能已变化，丢弃旧的人格索引
+        self.message_manager.clear_persona_cache()
+
         logger.info("启动随机日常任务")
         self.daily_task = asyncio.create_task(self._daily_check_loop())
 
@@ -131,56 +177,207 @@ class RandomDailyActivities:
             logger.info("随机日常任务已停止")
             self.daily_task = None
 
+        # 发送任务集合由完成回调自行清理，这里一次取消并等待全部结束
+        pending = [task for task in self._send_tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.info("已取消 %d 批发送中的随机日常消息", len(pending))
+
+    def _push_event(
+        self, when: float, kind: str, payload: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """加入一个定时事件并唤醒调度循环
+
+        Args:
+            when: 触发时间戳（秒）
+            kind: 事件类型
+            payload: 事件参数
+        """
+        self._event_seq += 1
+        heapq.heappush(self._event_heap, (when, self._event_seq, kind, payload))
+        self._wake.set()
+
+    def _schedule_send(self, now_ts: float, delay_minutes: int, **kwargs) -> None:
+        """在指定延迟后发送一条消息，由调度循环统一触发
+
+        Args:
+            now_ts: 本轮检查的当前时间戳
+            delay_minutes: 延迟分钟数
+            **kwargs: 传递给 _send_scheduled_message 的参数
+        """
+        self._push_event(now_ts + delay_minutes * 60, "send", kwargs)
+        # 日志级别未启用时跳过发送时间的格式化
+        if logger.isEnabledFor(logging.INFO):
+            scheduled_time = datetime.datetime.fromtimestamp(
+                now_ts + delay_minutes * 60
+            )
+            logger.info(
+                "已为用户 %s 安排%s消息，将在 %d 分钟后(%s)发送",
+                kwargs["user_id"],
+                kwargs["message_type"],
+                delay_minutes,
+                scheduled_time.strftime("%H:%M"),
+            )
+
+    async def _run_send_batch(self, payloads: List[Dict[str, Any]]) -> None:
+        """在同一个任务中发送一批已到期的消息
+
+        Args:
+            payloads: 每条消息传递给 _send_scheduled_message 的参数
+        """
+        await asyncio.gather(
+            *(self._run_scheduled_send(kwargs) for kwargs in payloads)
+        )
+
+    async def _run_scheduled_send(self, kwargs: Dict[str, Any]) -> None:
+        """执行一条已到期的消息发送，出错时只记录日志
+
+        Args:
+            kwargs: 传递给 _send_scheduled_message 的参数
+        """
+        meal_type = kwargs.pop("meal_type", None)
+        try:
+            await self._send_scheduled_message(**kwargs)
+        except Exception as e:
+            logger.error("发送%s消息时出错: %s", kwargs.get("message_type"), e)
+        finally:
+            # 无论发送成功与否，都结束该用户的用餐消息占用
+            if meal_type is not None:
+                self._pending_meal_users[meal_type].discard(kwargs["user_id"])
+
+    def _seed_events(self) -> None:
+        """根据当前配置安排各类事件的首次触发时间"""
+        now = datetime.datetime.now()
+        # 保留尚未发送的消息，只重新安排周期性事件
+        self._event_heap[:] = [
+            entry for entry in self._event_heap if entry[2] == "send"
+        ]
+        heapq.heapify(self._event_heap)
+        if self.lunch_enabled:
+            self._push_event(
+                next_window_start(
+                    self.lunch_start_hour, self.lunch_end_hour, now
+                ).timestamp(),
+                "lunch",
+            )
+        if self.dinner_enabled:
+            self._push_event(
+                next_window_start(
+                    self.dinner_start_hour, self.dinner_end_hour, now
+                ).timestamp(),
+                "dinner",
+            )
+        if self.sharing_enabled:
+            self._push_event(now.timestamp(), "sharing")
+
     async def _daily_check_loop(self):
-        """定时检查是否需要发送随机日常消息的循环"""
+        """休眠到最近一个事件的触发时间再处理的调度循环"""
         try:
+            self._seed_events()
+            event_heap = self._event_heap
+            wake = self._wake
+            loop = asyncio.get_running_loop()
+
             while True:
+                if not event_heap:
+                    wake.clear()
+                    await wake.wait()
+                    continue
+
+                # 堆顶事件未到期时休眠，由事件循环定时器在到期时唤醒，
+                # 加入新事件时也会提前唤醒；不为每次休眠创建超时任务
+                delay = event_heap[0][0] - time.time()
+                if delay > 0:
+                    wake.clear()
+                    timer = loop.call_later(delay, wake.set)
+                    try:
+                        await wake.wait()
+                    finally:
+                        timer.cancel()
+                    continue
+
+                _, _, kind, payload = heapq.heappop(event_heap)
+
+                # 同时到期的消息合并为一批，交给一个短期任务并发发送，不阻塞后续事件
+                if kind == "send":
+                    payloads = [payload]
+                    now_ts = time.time()
+                    while (
+                        event_heap
+                        and event_heap[0][2] == "send"
+                        and event_heap[0][0] <= now_ts
+                    ):
+                        payloads.append(heapq.heappop(event_heap)[3])
+                    task = asyncio.create_task(self._run_send_batch(payloads))
+                    self._send_tasks.add(task)
+                    task.add_done_callback(self._send_tasks.discard)
+                    continue
+
                 # 检查当前时间
                 now = datetime.datetime.now()
                 current_date = now.date()
-                current_hour = now.hour
 
                 # 如果日期变了，重置状态
                 if current_date != self.last_check_date:
-                    logger.info(f"日期已变更为 {current_date}，重置随机日常状态")
+                    logger.info("日期已变更为 %s，重置随机日常状态", current_date)
                     self.today_lunch_users.clear()
                     self.today_dinner_users.clear()
                     self.last_check_date = current_date
 
-                # 1. 检查是否在午餐时间段
-                if (
-                    self.lunch_enabled
-                    and self.lunch_start_hour <= current_hour < self.lunch_end_hour
-                ):
-                    await self._check_meal_time("lunch")
-
-                # 2. 检查是否在晚餐时间段
-                if (
-                    self.dinner_enabled
-                    and self.dinner_start_hour <= current_hour < self.dinner_end_hour
-                ):
-                    await self._check_meal_time("dinner")
-
-                # 3. 检查是否需要发送日常分享
-                if self.sharing_enabled:
-                    await self._check_daily_sharing()
-
-                # 每10s检查一次
-                await asyncio.sleep(10)
+                if kind == "lunch":
+                    await self._handle_meal_event(
+                        "lunch", self.lunch_start_hour, self.lunch_end_hour, now
+                    )
+                elif kind == "dinner":
+                    await self._handle_meal_event(
+                        "dinner", self.dinner_start_hour, self.dinner_end_hour, now
+                    )
+                elif kind == "sharing":
+                    await self._check_daily_sharing(now)
+                    self._push_event(
+                        self._next_sharing_event_ts(now.timestamp()), "sharing"
+                    )
 
         except asyncio.CancelledError:
             logger.info("随机日常检查循环已取消")
             raise
         except Exception as e:
-            logger.error(f"随机日常检查循环发生错误: {str(e)}")
+            logger.error("随机日常检查循环发生错误: %s", e)
+
+    async def _handle_meal_event(
+        self, meal_type: str, start_hour: int, end_hour: int, now: datetime.datetime
+    ):
+        """处理用餐事件，并安排下一次触发时间
+
+        在用餐时间段内每隔一段时间挑选一批用户，时间段结束后安排到下一次开始时刻。
+
+        Args:
+            meal_type: 用餐类型，"lunch" 或 "dinner"
+            start_hour: 用餐时间段开始小时
+            end_hour: 用餐时间段结束小时
+            now: 当前时间
+        """
+        if in_window(start_hour, end_hour, now.hour):
+            await self._check_meal_time(meal_type, now)
 
-    async def _check_meal_time(self, meal_type: str):
+        next_check = now + datetime.timedelta(seconds=self.meal_recheck_seconds)
+        self._push_event(
+            next_window_start(start_hour, end_hour, next_check).timestamp(),
+            meal_type,
+        )
+
+    async def _check_meal_time(self, meal_type: str, now: datetime.datetime):
         """检查是否需要发送用餐相关消息
 
         Args:
             meal_type: 用餐类型，"lunch" 或 "dinner"
+            now: 本轮检查的当前时间
         """
         try:
+            now_ts = now.timestamp()
+
             # 确定使用哪个已发送集合和提示词
             users_set = (
                 self.today_lunch_users
@@ -191,9 +388,13 @@ class RandomDailyActivities:
                 self.lunch_prompts if meal_type == "lunch" else self.dinner_prompts
             )
             meal_name = "午餐" if meal_type == "lunch" else "晚餐"
+            pending_users = self._pending_meal_users[meal_type]
 
-            # 获取所有符合条件的用户
-            eligible_users = self.user_manager.get_eligible_users(users_set)
+            # 获取所有符合条件的用户，排除今日已发送和仍在等待发送的用户
+            excluded_users = users_set | pending_users if pending_users else users_set
+            eligible_users = self.user_manager.get_eligible_users(
+                excluded_users, self.user_manager.whitelist_snapshot()
+            )
 
             if not eligible_users:
                 return
@@ -203,124 +404,205 @@ class RandomDailyActivities:
                 eligible_users, 0.3, 1
             )
 
-            for user_id, record in selected_users:
-                # 创建异步任务发送用餐消息
-                task_id = (
-                    f"{meal_type}_{user_id}_{int(datetime.datetime.now().timestamp())}"
-                )
-
-                # 使用任务管理器调度任务
-                await self.task_manager.schedule_task(
-                    task_id=task_id,
-                    coroutine_func=self._send_scheduled_message,
-                    random_delay=True,
-                    min_delay=1,
-                    max_delay=30,
+            # 一次性为所有选中用户抽取1-30分钟的延迟和提示词
+            count = len(selected_users)
+            delays = random.choices(range(1, 31), k=count)
+            chosen_prompts = random.choices(prompts, k=count)
+
+            for (user_id, record), delay_minutes, prompt in zip(
+                selected_users, delays, chosen_prompts
+            ):
+                # 加入调度堆，在随机延迟后发送用餐消息
+                self._schedule_send(
+                    now_ts,
+                    delay_minutes,
                     user_id=user_id,
                     conversation_id=record["conversation_id"],
                     unified_msg_origin=record["unified_msg_origin"],
                     message_type=meal_name,
-                    prompts=prompts,
+                    prompt=prompt,
+                    meal_type=meal_type,
                 )
 
-                # 将用户添加到今日已发送集合
+                # 将用户添加到今日已发送集合和等待发送集合
                 users_set.add(user_id)
+                pending_users.add(user_id)
 
         except Exception as e:
-            logger.error(f"检查{meal_type}时间任务时发生错误: {str(e)}")
+            logger.error("检查%s时间任务时发生错误: %s", meal_type, e)
+
+    def _sync_sharing_users(self, mono: float) -> None:
+        """将新出现的用户加入日常分享堆
+
+        用户记录只会新增，因此记录对象和大小都未变化时不需要比对。
+
+        Args:
+            mono: 当前单调时钟时间，新用户从此刻起即可分享
+        """
+        user_records = self.parent.dialogue_core.user_records
+        if (
+            user_records is self._synced_records
+            and len(user_records) == self._synced_count
+        ):
+            return
+
+        for user_id in user_records.keys() - self._sharing_known:
+            next_mono = self._draw_next_share(
+                mono, self.last_sharing_time.get(user_id)
+            )
+            heapq.heappush(self._sharing_heap, (next_mono, user_id))
+            self._sharing_known.add(user_id)
+
+        self._synced_records = user_records
+        self._synced_count = len(user_records)
+        self._update_next_sharing_scan()
+
+    def _draw_next_share(self, mono: float, last_time: Optional[float]) -> float:
+        """按每个检查间隔抽签一次的分享概率，直接抽取用户下一次分享的时间
+
+        首次分享每次检查50%概率；之后从最小间隔时的0%线性增加到最大间隔时的80%。
+        对各次检查未抽中的概率取对数累加，低于抽取的阈值时即为分享时刻，
+        与逐次检查抽签的结果分布相同，但不需要每个间隔都唤醒检查。
+
+        Args:
+            mono: 第一次检查的单调时钟时间
+            last_time: 上次分享的单调时钟时间，没有分享过时为None
+
+        Returns:
+            float: 下一次分享的单调时钟时间
+        """
+        step = self.sharing_check_seconds
+        log_u = math.log(1.0 - random.random())
+
+        if last_time is None:
+            # 概率固定时，抽中前的检查次数服从几何分布
+            return mono + step * math.floor(log_u / math.log(0.5))
+
+        min_seconds = self.min_interval_minutes * 60
+        max_seconds = self.max_interval_minutes * 60
+        # 未达到最小间隔前概率为0，从达到最小间隔的时刻开始抽签
+        check_at = max(mono, last_time + min_seconds)
+        log_miss = 0.0
+        while check_at - last_time < max_seconds:
+            # 线性插值计算概率，最高80%
+            probability = (
+                0.8 * (check_at - last_time - min_seconds) / (max_seconds - min_seconds)
+            )
+            if probability > 0:
+                log_miss += math.log1p(-probability)
+                if log_miss < log_u:
+                    return check_at
+            check_at += step
+
+        # 达到最大间隔后固定为80%概率
+        return check_at + step * math.floor((log_u - log_miss) / math.log(0.2))
+
+    def _update_next_sharing_scan(self) -> None:
+        """根据日常分享堆顶更新下一次需要检查分享的时间"""
+        self._next_sharing_scan_after = (
+            self._sharing_heap[0][0] if self._sharing_heap else math.inf
+        )
+
+    def _next_sharing_event_ts(self, now_ts: float) -> float:
+        """计算下一次日常分享事件的触发时间戳
+
+        最多间隔一个分享检查周期以发现新用户，堆顶更早到期时提前到堆顶的时间。
+
+        Args:
+            now_ts: 当前时间戳
+
+        Returns:
+            float: 下一次日常分享事件的触发时间戳
+        """
+        wait = self._next_sharing_scan_after - time.monotonic()
+        return now_ts + max(1.0, min(wait, self.sharing_check_seconds))
 
-    async def _check_daily_sharing(self):
-        """检查是否需要发送日常分享消息"""
+    async def _check_daily_sharing(self, now: datetime.datetime):
+        """发送已到分享时间的日常分享消息
+
+        Args:
+            now: 本轮检查的当前时间
+        """
         try:
-            now = datetime.datetime.now()
+            # 间隔计算使用单调时钟，墙上时间只用于时间段和消息调度
+            now_ts = now.timestamp()
+            mono = time.monotonic()
 
             # 获取当前时间段名称
-            current_hour = now.hour
-            if 5 <= current_hour < 12:
-                time_period = "早上"
-            elif 12 <= current_hour < 18:
-                time_period = "下午"
-            elif 18 <= current_hour < 23:
-                time_period = "晚上"
-            else:
-                time_period = "深夜"
-
-            # 遍历每个用户，检查是否符合条件
-            # 获取所有符合条件的用户
-            eligible_users = []
-
-            # 检查现有用户记录
-            for user_id, record in list(self.parent.dialogue_core.user_records.items()):
-                # 检查是否在白名单中
-                if not self.user_manager.is_user_in_whitelist(user_id):
-                    continue
-
-                # 检查最后分享时间
-                last_time = self.last_sharing_time.get(user_id)
-                if last_time:
-                    minutes_since_last = (now - last_time).total_seconds() / 60
-                    if minutes_since_last < self.min_interval_minutes:
-                        # 未达到最小间隔，跳过
-                        continue
+            time_period = PERIOD_BY_HOUR[now.hour]
 
-                # 符合条件的用户
-                eligible_users.append((user_id, record))
+            self._sync_sharing_users(mono)
 
-            if not eligible_users:
+            # 堆顶用户尚未到分享时间时，其余用户也都未到期，直接结束本次检查
+            if mono < self._next_sharing_scan_after:
                 return
 
-            # 遍历用户，随机决定是否发送分享消息
-            for user_id, record in eligible_users:
-                # 计算发送概率 - 基于上次发送时间的间隔
-                last_time = self.last_sharing_time.get(user_id)
-
-                if last_time:
-                    minutes_since_last = (now - last_time).total_seconds() / 60
-                    # 线性增加概率，从最小间隔时的0%到最大间隔时的80%
-                    if minutes_since_last >= self.max_interval_minutes:
-                        probability = 0.8  # 80%概率
-                    else:
-                        # 线性插值计算概率
-                        ratio = (minutes_since_last - self.min_interval_minutes) / (
-                            self.max_interval_minutes - self.min_interval_minutes
-                        )
-                        probability = ratio * 0.8  # 最高80%概率
-                else:
-                    # 首次分享，50%概率
-                    probability = 0.5
-
-                # 根据概率决定是否发送
-                import random
-
-                if random.random() <= probability:
-                    # 决定发送，为用户安排10分钟内随机时间发送消息
-                    prompts = self.time_period_prompts.get(time_period, [])
-                    if not prompts:
-                        continue
-
-                    # 创建异步任务发送日常分享消息
-                    task_id = f"sharing_{user_id}_{int(now.timestamp())}"
-
-                    # 使用任务管理器调度任务
-                    await self.task_manager.schedule_task(
-                        task_id=task_id,
-                        coroutine_func=self._send_scheduled_message,
-                        random_delay=True,
-                        min_delay=1,
-                        max_delay=10,
-                        user_id=user_id,
-                        conversation_id=record["conversation_id"],
-                        unified_msg_origin=record["unified_msg_origin"],
-                        message_type=f"{time_period}日常分享",
-                        prompts=prompts,
-                        time_period=time_period,
+            sharing_heap = self._sharing_heap
+            user_records = self.parent.dialogue_core.user_records
+            prompts = self.time_period_prompts.get(time_period, [])
+            min_interval_seconds = self.min_interval_minutes * 60
+            randint, randrange = random.randint, random.randrange
+            draw_next_share = self._draw_next_share
+            # 本次检查使用同一份白名单快照，None表示未启用白名单
+            whitelist = self.user_manager.whitelist_snapshot()
+
+            # 从堆顶取出已到分享时间的用户，堆顶未到期时其余用户也都未到期；
+            # 重新入堆的时间都晚于当前时间，不会在本轮再次取出
+            while sharing_heap and sharing_heap[0][0] <= mono:
+                _, user_id = heapq.heappop(sharing_heap)
+                record = user_records.get(user_id)
+                if record is None:
+                    self._sharing_known.discard(user_id)
+                    continue
+
+                # 检查是否在白名单中，不在时等到下一个最小间隔后重新抽取分享时间
+                if whitelist is not None and user_id not in whitelist:
+                    heapq.heappush(
+                        sharing_heap,
+                        (
+                            draw_next_share(
+                                mono + min_interval_seconds,
+                                self.last_sharing_time.get(user_id),
+                            ),
+                            user_id,
+                        ),
+                    )
+                    continue
+
+                # 当前时间段没有提示词时，从下一次检查开始重新抽取分享时间
+                if not prompts:
+                    heapq.heappush(
+                        sharing_heap,
+                        (
+                            draw_next_share(
+                                mono + self.sharing_check_seconds,
+                                self.last_sharing_time.get(user_id),
+                            ),
+                            user_id,
+                        ),
                     )
+                    continue
+
+                # 已到抽取的分享时间，为用户安排10分钟内随机时间发送消息
+                self._schedule_send(
+                    now_ts,
+                    randint(1, 10),
+                    user_id=user_id,
+                    conversation_id=record["conversation_id"],
+                    unified_msg_origin=record["unified_msg_origin"],
+                    message_type=f"{time_period}日常分享",
+                    prompt=prompts[randrange(len(prompts))],
+                    time_period=time_period,
+                )
+
+                # 更新最后分享时间，并按分享概率抽取下一次分享的时间
+                self.last_sharing_time[user_id] = mono
+                heapq.heappush(sharing_heap, (draw_next_share(mono, mono), user_id))
 
-                    # 更新最后分享时间
-                    self.last_sharing_time[user_id] = now
+            self._update_next_sharing_scan()
 
         except Exception as e:
-            logger.error(f"检查日常分享任务时发生错误: {str(e)}")
+            logger.error("检查日常分享任务时发生错误: %s", e)
 
     async def _send_scheduled_message(
         self,
@@ -328,7 +610,7 @@ class RandomDailyActivities:
         conversation_id,
         unified_msg_origin,
         message_type,
-        prompts,
+        prompt,
         time_period=None,
     ):
         """发送计划的消息
@@ -338,12 +620,16 @@ class RandomDailyActivities:
             conversation_id: 会话ID
             unified_msg_origin: 统一消息来源
             message_type: 消息类型描述
-            prompts: 提示词列表
+            prompt: 调度时选定的提示词
             time_period: 可选的时间段描述
         """
         # 再次检查用户是否在白名单中
-        if not self.user_manager.is_user_in_whitelist(user_id):
-            logger.info(f"用户 {user_id} 不再在白名单中，取消发送{message_type}消息")
+        dialogue_core = self.parent.dialogue_core
+        if (
+            dialogue_core.whitelist_enabled
+            and user_id not in dialogue_core.whitelist_users
+        ):
+            logger.info("用户 %s 不再在白名单中，取消发送%s消息", user_id, message_type)
             return
 
         # 使用消息管理器发送消息
@@ -351,7 +637,7 @@ class RandomDailyActivities:
             user_id=user_id,
             conversation_id=conversation_id,
             unified_msg_origin=unified_msg_origin,
-            prompts=prompts,
+            prompt=prompt,
             message_type=message_type,
             time_period=time_period,
         )
@@ -33,6 +33,9 @@ class InitiativeDialogue(Star):
         # 确保数据目录存在
         self.data_dir.mkdir(exist_ok=True)
 
+        # 各模块共享的消息任务字典，任务ID -> 任务
+        self._message_tasks = {}
+
         # 初始化核心对话模块
         self.dialogue_core = InitiativeDialogueCore(self, self)
 
@@ -82,15 +85,10 @@ class InitiativeDialogue(Star):
     @filter.on_llm_request()
     async def check_initiative_response(self, event, req: ProviderRequest):
         """检查是否是对主动消息的回复，并修改提示词"""
-        if event is None:
-            return
-
         try:
             user_id = str(event.get_sender_id())
             # 委托给核心模块处理请求修改
-            self.dialogue_core.modify_llm_request_for_initiative_response(
-                user_id, event, req
-            )
+            self.dialogue_core.modify_llm_request_for_initiative_response(user_id, req)
 
         except Exception as e:
             logger.error(f"[钩子错误] 处理用户回复主动消息时出错: {str(e)}")
@@ -114,6 +112,14 @@ class InitiativeDialogue(Star):
         # 停止随机日常任务
         await self.random_daily.stop()
 
+        # 取消所有尚未执行的延迟消息任务，并一次等待它们结束
+        pending = [task for task in self._message_tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._message_tasks.clear()
+
     @filter.command("initiative_test_message")
     async def test_initiative_message(self, event: AstrMessageEvent):
         """测试主动消息生成"""
@@ -3,8 +3,39 @@
 import asyncio
 import datetime
 import json
+import os
+import tempfile
+import threading
 from astrbot.api import logger
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_default(obj: Any) -> Any:
+    """json回退序列化时将datetime转换为ISO格式字符串"""
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps(data: Dict[str, Any]) -> bytes:
+    """序列化存储数据，优先使用orjson，datetime直接序列化为ISO格式字符串"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        data, ensure_ascii=False, indent=2, default=_json_default
+    ).encode("utf-8")
+
+
+def _loads(raw: bytes) -> Dict[str, Any]:
+    """反序列化存储数据，优先使用orjson"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode("utf-8"))
 
 
 class DataLoader:
@@ -28,95 +59,121 @@ class DataLoader:
 
         self.save_data_task = None
 
+        # 定期保存在工作线程中写文件，关闭时的最终保存在事件循环线程中写文件；
+        # 写文件互斥执行，并按快照序号丢弃比已写入内容更旧的快照
+        self._save_lock = threading.Lock()
+        self._snapshot_seq = 0
+        self._saved_seq = 0
+
         DataLoader._instance = self
 
     def load_data_from_storage(self) -> None:
         try:
             if self.data_file.exists():
-                with open(self.data_file, "r", encoding="utf-8") as f:
-                    stored_data = json.load(f)
-
-                    if "user_records" in stored_data:
-                        for user_id, record in stored_data["user_records"].items():
-                            if "timestamp" in record and isinstance(
-                                record["timestamp"], str
-                            ):
-                                try:
-                                    record["timestamp"] = (
-                                        datetime.datetime.fromisoformat(
-                                            record["timestamp"]
-                                        )
+                stored_data = _loads(self.data_file.read_bytes())
+
+                if "user_records" in stored_data:
+                    for user_id, record in stored_data["user_records"].items():
+                        if "timestamp" in record and isinstance(
+                            record["timestamp"], str
+                        ):
+                            try:
+                                record["timestamp"] = (
+                                    datetime.datetime.fromisoformat(
+                                        record["timestamp"]
                                     )
-                                except ValueError:
-                                    record["timestamp"] = datetime.datetime.now()
-                    if "last_initiative_messages" in stored_data:
-                        for user_id, record in stored_data[
-                            "last_initiative_messages"
-                        ].items():
-                            if "timestamp" in record and isinstance(
-                                record["timestamp"], str
-                            ):
-                                try:
-                                    record["timestamp"] = (
-                                        datetime.datetime.fromisoformat(
-                                            record["timestamp"]
-                                        )
+                                )
+                            except ValueError:
+                                record["timestamp"] = datetime.datetime.now()
+                if "last_initiative_messages" in stored_data:
+                    for user_id, record in stored_data[
+                        "last_initiative_messages"
+                    ].items():
+                        if "timestamp" in record and isinstance(
+                            record["timestamp"], str
+                        ):
+                            try:
+                                record["timestamp"] = (
+                                    datetime.datetime.fromisoformat(
+                                        record["timestamp"]
                                     )
-                                except ValueError:
-                                    record["timestamp"] = datetime.datetime.now()
-
-                    self.dialogue_core.set_data(
-                        user_records=stored_data.get("user_records", {}),
-                        last_initiative_messages=stored_data.get(
-                            "last_initiative_messages", {}
-                        ),
-                        users_received_initiative=set(
-                            stored_data.get("users_received_initiative", [])
-                        ),
-                    )
+                                )
+                            except ValueError:
+                                record["timestamp"] = datetime.datetime.now()
+
+                self.dialogue_core.set_data(
+                    user_records=stored_data.get("user_records", {}),
+                    last_initiative_messages=stored_data.get(
+                        "last_initiative_messages", {}
+                    ),
+                    users_received_initiative=set(
+                        stored_data.get("users_received_initiative", [])
+                    ),
+                )
             logger.info(f"成功从 {self.data_file} 加载用户数据")
         except Exception as e:
             logger.error(f"从存储加载数据时发生错误: {str(e)}")
 
     def save_data_to_storage(self) -> None:
         """将数据保存到本地存储"""
+        self._save_sync(*self._snapshot())
+
+    def _snapshot(self) -> Tuple[int, Dict[str, Any]]:
+        """在事件循环线程中复制当前数据，得到可以交给其他线程序列化的快照
+
+        记录字典在更新时整体替换而不会原地修改，因此只需浅复制外层字典；
+        datetime字段由序列化函数直接输出为ISO格式字符串。
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: 快照序号和待保存的数据快照
+        """
+        core_data = self.dialogue_core.get_data()
+        self._snapshot_seq += 1
+
+        return self._snapshot_seq, {
+            "user_records": dict(core_data.get("user_records", {})),
+            "last_initiative_messages": dict(
+                core_data.get("last_initiative_messages", {})
+            ),
+            "users_received_initiative": list(
+                core_data.get("users_received_initiative", [])
+            ),
+        }
+
+    def _save_sync(self, seq: int, snapshot: Dict[str, Any]) -> None:
+        """序列化数据快照并写入存储文件，可在工作线程中执行
+
+        Args:
+            seq: 快照序号，由 _snapshot() 生成
+            snapshot: 由 _snapshot() 生成的数据快照
+        """
+        tmp_path = None
         try:
-            core_data = self.dialogue_core.get_data()
-
-            data_to_save = {
-                "user_records": self._prepare_records_for_save(
-                    core_data.get("user_records", {})
-                ),
-                "last_initiative_messages": self._prepare_records_for_save(
-                    core_data.get("last_initiative_messages", {})
-                ),
-                "users_received_initiative": list(
-                    core_data.get("users_received_initiative", [])
-                ),
-            }
-
-            with open(self.data_file, "w", encoding="utf-8") as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=2)
+            payload = _dumps(snapshot)
+            with self._save_lock:
+                # 已写入更新的快照时不再用旧快照覆盖
+                if seq <= self._saved_seq:
+                    return
+
+                # 先写入唯一的临时文件再原子替换，避免写入中断导致数据文件损坏
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=self.data_dir, prefix=".umo_storage_", suffix=".tmp"
+                )
+                with os.fdopen(fd, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.data_file)
+                tmp_path = None
+                self._saved_seq = seq
 
             logger.info(f"数据已保存到 {self.data_file}")
         except Exception as e:
             logger.error(f"保存数据到存储时发生错误: {str(e)}")
-
-    def _prepare_records_for_save(self, records: Dict[str, Any]) -> Dict[str, Any]:
-        """准备记录以便保存，将datetime对象转换为ISO格式字符串"""
-        prepared_records = {}
-
-        for user_id, record in records.items():
-            record_copy = dict(record)
-
-            if "timestamp" in record_copy and isinstance(
-                record_copy["timestamp"], datetime.datetime
-            ):
-                record_copy["timestamp"] = record_copy["timestamp"].isoformat()
-
-            prepared_records[user_id] = record_copy
-
-        return prepared_records
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
 
     async def start_periodic_save(self) -> None:
         """启动定期保存数据的任务"""
@@ -144,7 +201,14 @@ class DataLoader:
         try:
             while True:
                 await asyncio.sleep(300)
-                self.save_data_to_storage()
+
+                # 数据没有变更时跳过本次保存
+                if not self.dialogue_core._dirty:
+                    continue
+                self.dialogue_core._dirty = False
+
+                # 快照在事件循环中生成，序列化和写文件放到线程中执行
+                await asyncio.to_thread(self._save_sync, *self._snapshot())
         except asyncio.CancelledError:
             self.save_data_to_storage()
             logger.info("定期保存数据任务已取消")
@@ -0,0 +1,80 @@
+# 过期集合 - 带有存活时间和容量上限的集合
+
+import time
+from collections import OrderedDict
+from typing import Hashable, Iterable, Iterator
+
+
+class ExpiringSet:
+    """按加入时间淘汰元素的集合，超过存活时间或容量上限的最早元素会被移除"""
+
+    def __init__(self, ttl_seconds: float, max_size: int = 10000):
+        """初始化过期集合
+
+        Args:
+            ttl_seconds: 元素的存活时间（秒）
+            max_size: 最多保留的元素数量
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        # 元素 -> 加入时的单调时钟时间，按加入顺序排列
+        self._items: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        """从最早加入的元素开始移除已过期或超出容量的元素
+
+        Args:
+            now: 当前单调时钟时间
+        """
+        items = self._items
+        expire_before = now - self.ttl_seconds
+        while items:
+            item, added_at = next(iter(items.items()))
+            if added_at >= expire_before and len(items) <= self.max_size:
+                break
+            items.popitem(last=False)
+
+    def add(self, item: Hashable) -> None:
+        """加入元素，已存在时刷新其加入时间
+
+        Args:
+            item: 要加入的元素
+        """
+        now = time.monotonic()
+        self._items[item] = now
+        self._items.move_to_end(item)
+        self._evict(now)
+
+    def update(self, items: Iterable[Hashable]) -> None:
+        """批量加入元素
+
+        Args:
+            items: 要加入的元素
+        """
+        for item in items:
+            self.add(item)
+
+    def discard(self, item: Hashable) -> None:
+        """移除元素，不存在时不做任何操作
+
+        Args:
+            item: 要移除的元素
+        """
+        self._items.pop(item, None)
+
+    def __contains__(self, item: Hashable) -> bool:
+        added_at = self._items.get(item)
+        if added_at is None:
+            return False
+        if added_at < time.monotonic() - self.ttl_seconds:
+            self._items.pop(item, None)
+            return False
+        return True
+
+    def __len__(self) -> int:
+        self._evict(time.monotonic())
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        self._evict(time.monotonic())
+        return iter(self._items)
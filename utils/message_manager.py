@@ -1,18 +1,19 @@
 # 消息管理器 - 处理消息生成和发送逻辑
 
-import json
 import random
 import logging
-from typing import List, Dict, Any, Optional, AsyncGenerator
+import traceback
+from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple
 from astrbot.api.all import (
     AstrBotMessage,
     MessageType,
     MessageMember,
-    MessageChain,
     MessageEventResult,
 )
-from astrbot.api.event import MessageChain
 from astrbot.api.message_components import Plain
+from astrbot.core.platform.platform_metadata import PlatformMetadata
+
+from .aiocqhttp_message_event import AiocqhttpMessageEvent
 
 logger = logging.getLogger("message_manager")
 
@@ -29,15 +30,25 @@ class MessageManager:
         self.parent = parent
         self.context = parent.context
 
+        # 已调整的提示词缓存: (提示词, 时间段) -> 完整提示词
+        self._adjusted_prompts: Dict[Tuple[str, Optional[str]], str] = {}
+
+        # 人格索引缓存: (建立索引时的人格列表对象, 人格ID -> 人格)
+        self._persona_index: Tuple[Optional[list], Dict[str, Dict[str, Any]]] = (
+            None,
+            {},
+        )
+
     async def generate_and_send_message(
         self,
         user_id: str,
         conversation_id: str,
         unified_msg_origin: str,
-        prompts: List[str],
+        prompts: Optional[List[str]] = None,
         message_type: str = "一般",
         time_period: Optional[str] = None,
         extra_context: Optional[str] = None,
+        prompt: Optional[str] = None,
     ):
         """生成并发送消息
 
@@ -49,6 +60,7 @@ class MessageManager:
             message_type: 消息类型描述（用于日志）
             time_period: 时间段描述（如"早上"、"下午"等）
             extra_context: 额外的上下文信息
+            prompt: 已选定的提示词，提供时不再从prompts中随机选择
 
         """
         try:
@@ -67,22 +79,17 @@ class MessageManager:
             # 获取对话历史和系统提示
             system_prompt = "你是一个可爱的AI助手，喜欢和用户互动。"
 
-            # 获取当前对话的人格设置
-            if conversation:
-                persona_id = conversation.persona_id
-
-                # 获取对话使用的人格设置
-                system_prompt = self._get_system_prompt(persona_id, system_prompt)
+            # 获取对话使用的人格设置
+            system_prompt = self._get_system_prompt(
+                conversation.persona_id, system_prompt
+            )
 
-            # 随机选择一个提示词
-            prompt = random.choice(prompts)
+            # 未预先选定时随机选择一个提示词
+            if prompt is None:
+                prompt = random.choice(prompts)
 
             # 调整提示词
-            adjusted_prompt = prompt
-            if time_period:
-                adjusted_prompt = f"{prompt}，现在是{time_period}，请保持与你的人格设定一致的风格，确保回复符合你的人设特点。"
-            else:
-                adjusted_prompt = f"{prompt}，请保持与你的人格设定一致的风格，确保回复符合你的人设特点。"
+            adjusted_prompt = self._adjust_prompt(prompt, time_period)
 
             if extra_context:
                 adjusted_prompt = f"{adjusted_prompt} {extra_context}"
@@ -91,8 +98,9 @@ class MessageManager:
             func_tools_mgr = self.context.get_llm_tool_manager()
 
             # 调用LLM获取回复
-            logger.info(f"正在为用户 {user_id} 生成{message_type}消息内容...")
-            logger.debug(f"使用的提示词: {adjusted_prompt}")
+            logger.info("正在为用户 %s 生成%s消息内容...", user_id, message_type)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("使用的提示词: %s", adjusted_prompt)
 
             platform = self.context.get_platform("aiocqhttp")
             fake_event = self.create_fake_event(
@@ -104,6 +112,7 @@ class MessageManager:
             )
             platform.commit_event(fake_event)
             self.parent.dialogue_core.users_received_initiative.add(user_id)
+            self.parent.dialogue_core.mark_dirty()
             return fake_event.request_llm(
                 prompt=adjusted_prompt,
                 func_tool_manager=func_tools_mgr,
@@ -113,14 +122,44 @@ class MessageManager:
             )
 
         except Exception as e:
-            import traceback
-
             error_traceback = traceback.format_exc()
             logger.error(
                 f"发送{message_type}消息时发生错误: {str(e)}\n{error_traceback}"
             )
             return
 
+    def _adjust_prompt(self, prompt: str, time_period: Optional[str]) -> str:
+        """为提示词追加时间段与人设要求，结果按(提示词, 时间段)缓存
+
+        Args:
+            prompt: 原始提示词
+            time_period: 时间段描述
+
+        Returns:
+            str: 调整后的提示词
+        """
+        key = (prompt, time_period)
+        adjusted_prompt = self._adjusted_prompts.get(key)
+        if adjusted_prompt is None:
+            if time_period:
+                adjusted_prompt = f"{prompt}，现在是{time_period}，请保持与你的人格设定一致的风格，确保回复符合你的人设特点。"
+            else:
+                adjusted_prompt = f"{prompt}，请保持与你的人格设定一致的风格，确保回复符合你的人设特点。"
+            self._adjusted_prompts[key] = adjusted_prompt
+        return adjusted_prompt
+
+    def preformat_prompts(
+        self, prompts: List[str], time_period: Optional[str] = None
+    ) -> None:
+        """预先生成一组提示词调整后的版本，发送时直接命中缓存
+
+        Args:
+            prompts: 原始提示词列表
+            time_period: 时间段描述
+        """
+        for prompt in prompts:
+            self._adjust_prompt(prompt, time_period)
+
     def parse_unified_msg_origin(self, unified_msg_origin: str):
         """解析统一消息来源
 
@@ -148,9 +187,6 @@ class MessageManager:
         session_id: str,
         sender_id: str = "123456",
     ):
-        from astrbot.core.platform.platform_metadata import PlatformMetadata
-        from .aiocqhttp_message_event import AiocqhttpMessageEvent
-
         abm = AstrBotMessage()
         abm.message_str = message_str
         abm.message = [Plain(message_str)]
@@ -190,6 +226,10 @@ class MessageManager:
 
         return event
 
+    def clear_persona_cache(self) -> None:
+        """清空人格索引缓存，下次查询时重新读取人格列表"""
+        self._persona_index = (None, {})
+
     def _get_system_prompt(self, persona_id: Optional[str], default_prompt: str) -> str:
         """获取系统提示词
 
@@ -207,11 +247,16 @@ class MessageManager:
                 if default_persona:
                     return default_persona.get("prompt", default_prompt)
             elif persona_id != "[%None]":
-                # 使用指定人格
+                # 使用指定人格，人格列表对象变化时重建 人格ID -> 人格 的索引
                 personas = self.context.provider_manager.personas
-                for persona in personas:
-                    if persona.get("id") == persona_id:
-                        return persona.get("prompt", default_prompt)
+                cached_ref, cached_map = self._persona_index
+                if cached_ref is not personas:
+                    cached_map = {persona.get("id"): persona for persona in personas}
+                    self._persona_index = (personas, cached_map)
+
+                persona = cached_map.get(persona_id)
+                if persona:
+                    return persona.get("prompt", default_prompt)
         except Exception as e:
             logger.error(f"获取人格信息时出错: {str(e)}")
 
@@ -2,9 +2,10 @@
 
 import asyncio
 import logging
-import datetime
+import functools
 import random
-from typing import Callable, Dict, Any, Optional
+import sys
+from typing import Callable, Dict, Any, List, Optional
 
 logger = logging.getLogger("task_manager")
 
@@ -20,81 +21,109 @@ class TaskManager:
         """
         self.parent = parent
 
-        # 确保任务存储字典存在
+        # 确保任务存储字典存在，并在初始化时绑定引用
         if not hasattr(self.parent, "_message_tasks"):
             self.parent._message_tasks = {}
+        self.message_tasks: Dict[str, asyncio.Task] = self.parent._message_tasks
 
-    async def schedule_task(
+    async def schedule_batch(
         self,
         task_id: str,
         coroutine_func: Callable[..., Any],
-        delay_minutes: int = 0,
-        random_delay: bool = False,
+        jobs: List[Dict[str, Any]],
         min_delay: int = 1,
         max_delay: int = 30,
-        **kwargs,
-    ) -> asyncio.Task:
-        """创建并调度一个延迟执行的任务
+    ) -> Optional[asyncio.Task]:
+        """为一批参数创建单个监督任务，每个参数在随机延迟后执行一次协程函数
 
         Args:
-            task_id: 任务唯一标识符
+            task_id: 监督任务唯一标识符
             coroutine_func: 异步协程函数
-            delay_minutes: 固定延迟分钟数
-            random_delay: 是否使用随机延迟
+            jobs: 每次调用协程函数的参数字典列表
             min_delay: 随机延迟最小分钟数
             max_delay: 随机延迟最大分钟数
-            **kwargs: 传递给协程函数的参数
 
         Returns:
-            asyncio.Task: 创建的任务对象
+            Optional[asyncio.Task]: 创建的监督任务，没有待执行的参数时返回None
         """
-        # 计算实际延迟时间
-        actual_delay = delay_minutes
-        if random_delay:
-            actual_delay = random.randint(min_delay, max_delay)
+        if not jobs:
+            return None
 
-        # 创建任务
-        async def delayed_task():
+        # 预先抽取每项的延迟并排序，由单个协程按顺序休眠，避免同时挂起N个定时器
+        scheduled = sorted(
+            (random.randint(min_delay, max_delay), index, kwargs)
+            for index, kwargs in enumerate(jobs)
+        )
+
+        async def run_job(kwargs: Dict[str, Any]):
+            # 单项失败只记录日志，不影响同批的其他任务
             try:
-                # 等待指定的延迟时间
-                await asyncio.sleep(actual_delay * 60)
-                # 执行实际任务
                 await coroutine_func(**kwargs)
+            except Exception as e:
+                logger.error(f"批量任务 {task_id} 执行出错: {str(e)}")
+
+        async def release(spawn: Callable[[Any], Any]):
+            prev_delay = 0
+            for delay, _, kwargs in scheduled:
+                if delay > prev_delay:
+                    await asyncio.sleep((delay - prev_delay) * 60)
+                    prev_delay = delay
+                # 实际发送作为独立任务执行，使多个请求的等待时间可以重叠
+                spawn(run_job(kwargs))
+
+        async def supervisor():
+            try:
+                if sys.version_info >= (3, 11):
+                    # TaskGroup 负责子任务的生命周期，取消时会一并取消已启动的子任务
+                    async with asyncio.TaskGroup() as tg:
+                        await release(tg.create_task)
+                else:
+                    launched = []
+                    try:
+                        await release(
+                            lambda coro: launched.append(asyncio.create_task(coro))
+                        )
+                        await asyncio.gather(*launched)
+                    except asyncio.CancelledError:
+                        for t in launched:
+                            if not t.done():
+                                t.cancel()
+                        raise
             except asyncio.CancelledError:
-                logger.info(f"任务 {task_id} 已被取消")
+                logger.info(f"批量任务 {task_id} 已被取消")
                 raise
-            except Exception as e:
-                logger.error(f"任务 {task_id} 执行出错: {str(e)}")
-
-        # 创建任务并存储
-        task = asyncio.create_task(delayed_task())
-        self.parent._message_tasks[task_id] = task
 
-        # 设置完成回调以清理任务引用
-        def remove_task(t, tid=task_id):
-            if tid in self.parent._message_tasks:
-                self.parent._message_tasks.pop(tid, None)
+        # 整批只创建一个任务并存储
+        task = asyncio.create_task(supervisor())
+        self.message_tasks[task_id] = task
 
-        task.add_done_callback(remove_task)
+        task.add_done_callback(functools.partial(self._remove_task, task_id))
 
-        # 记录任务调度信息
-        scheduled_time = datetime.datetime.now() + datetime.timedelta(
-            minutes=actual_delay
-        )
         logger.info(
-            f"任务 {task_id} 已调度，将在 {actual_delay} 分钟后({scheduled_time.strftime('%H:%M')})执行"
+            f"批量任务 {task_id} 已调度，共 {len(jobs)} 项，将在 {min_delay}-{max_delay} 分钟内陆续执行"
         )
 
         return task
 
+    def _remove_task(self, task_id: str, task: asyncio.Task) -> None:
+        """任务完成回调，仅当存储的仍是该任务时移除其引用
+
+        Args:
+            task_id: 任务ID
+            task: 已完成的任务
+        """
+        if self.message_tasks.get(task_id) is task:
+            del self.message_tasks[task_id]
+
     def cancel_all_tasks(self) -> None:
         """取消所有正在运行的任务"""
-        for task_id, task in list(self.parent._message_tasks.items()):
+        # cancel() 不会同步触发完成回调，遍历时字典不会被修改
+        for task_id, task in self.message_tasks.items():
             if not task.done():
                 task.cancel()
                 logger.info(f"任务 {task_id} 已取消")
 
-        self.parent._message_tasks.clear()
+        self.message_tasks.clear()
 
     def cancel_task(self, task_id: str) -> bool:
         """取消指定ID的任务
@@ -105,8 +134,8 @@ class TaskManager:
         Returns:
             bool: 是否成功取消
         """
-        if task_id in self.parent._message_tasks:
-            task = self.parent._message_tasks[task_id]
+        if task_id in self.message_tasks:
+            task = self.message_tasks[task_id]
             if not task.done():
                 task.cancel()
                 logger.info(f"任务 {task_id} 已取消")
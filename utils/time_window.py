@@ -0,0 +1,43 @@
+# 时间段工具 - 计算按小时配置的时间段的触发时刻
+
+import datetime
+
+
+def in_window(start_hour: int, end_hour: int, hour: int) -> bool:
+    """判断小时是否处于时间段内
+
+    结束小时不大于开始小时时，时间段跨过午夜，例如22点到2点。
+
+    Args:
+        start_hour: 时间段开始小时
+        end_hour: 时间段结束小时，24表示第二天的0点
+        hour: 要判断的小时
+
+    Returns:
+        bool: 是否处于时间段内
+    """
+    if start_hour < end_hour:
+        return start_hour <= hour < end_hour
+    # 处理跨日的情况
+    return hour >= start_hour or hour < end_hour
+
+
+def next_window_start(
+    start_hour: int, end_hour: int, now: datetime.datetime
+) -> datetime.datetime:
+    """计算时间段下一次处于活动状态的时刻
+
+    Args:
+        start_hour: 时间段开始小时
+        end_hour: 时间段结束小时，24表示第二天的0点，小于开始小时表示跨日
+        now: 当前时间
+
+    Returns:
+        datetime.datetime: 当前已处于时间段内时返回now，否则返回下一次开始时刻
+    """
+    if in_window(start_hour, end_hour, now.hour):
+        return now
+    target = now.replace(hour=start_hour % 24, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return target
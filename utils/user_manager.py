@@ -2,7 +2,7 @@
 
 import random
 import logging
-from typing import List, Dict, Any, Set, Tuple
+from typing import List, Dict, Any, FrozenSet, Optional, Set, Tuple
 
 logger = logging.getLogger("user_manager")
 
@@ -25,64 +25,33 @@ class UserManager:
         return self.parent.dialogue_core
 
     def get_eligible_users(
-        self, excluded_users: Set[str]
+        self, excluded_users: Set[str], whitelist: Optional[FrozenSet[str]]
     ) -> List[Tuple[str, Dict[str, Any]]]:
         """获取符合条件的用户（未在排除集合中且在白名单内）
 
         Args:
             excluded_users: 要排除的用户ID集合
+            whitelist: 调用方本次调度使用的白名单快照，None表示未启用白名单
 
         Returns:
             List[Tuple[str, Dict]]: 符合条件的用户ID和用户记录元组列表
         """
-        eligible_users = []
-
-        # 检查现有用户记录
-        for user_id, record in list(self.dialogue_core.user_records.items()):
-            # 检查是否已经在排除集合中
-            if user_id in excluded_users:
-                continue
-
-            # 检查是否在白名单中
-            if (
-                self.dialogue_core.whitelist_enabled
-                and user_id not in self.dialogue_core.whitelist_users
-            ):
-                continue
-
-            # 符合条件的用户
-            eligible_users.append((user_id, record))
-
-        # 检查历史用户记录
-        if hasattr(self.dialogue_core, "last_initiative_messages"):
-            for user_id, record in list(
-                self.dialogue_core.last_initiative_messages.items()
-            ):
-                # 跳过已在结果中的用户
-                if any(uid == user_id for uid, _ in eligible_users):
-                    continue
-
-                # 检查是否已经在排除集合中
-                if user_id in excluded_users:
-                    continue
-
-                # 检查是否在白名单中
-                if (
-                    self.dialogue_core.whitelist_enabled
-                    and user_id not in self.dialogue_core.whitelist_users
-                ):
-                    continue
-
-                # 符合条件的用户
-                eligible_users.append(
-                    (
-                        user_id,
-                        {
-                            "conversation_id": record["conversation_id"],
-                            "unified_msg_origin": record["unified_msg_origin"],
-                        },
-                    )
-                )
+        if whitelist is not None and not whitelist:
+            return []
+
+        # 合并历史主动消息记录与现有用户记录，现有记录优先
+        merged = {
+            **self.dialogue_core.last_initiative_messages,
+            **self.dialogue_core.user_records,
+        }
+
+        # 一次遍历完成排除集合与白名单筛选
+        eligible_users = [
+            (user_id, record)
+            for user_id, record in merged.items()
+            if user_id not in excluded_users
+            and (whitelist is None or user_id in whitelist)
+        ]
 
         return eligible_users
 
@@ -123,4 +92,15 @@ class UserManager:
         if not self.dialogue_core.whitelist_enabled:
             return True
 
-        return user_id in self.dialogue_core.whitelist_users
\ No newline at end of file
+        return user_id in self.dialogue_core.whitelist_users
+
+    def whitelist_snapshot(self) -> Optional[FrozenSet[str]]:
+        """获取当前白名单的不可变快照，供一次调度过程内复用
+
+        Returns:
+            Optional[FrozenSet[str]]: 白名单用户集合，未启用白名单时返回None
+        """
+        if not self.dialogue_core.whitelist_enabled:
+            return None
+
+        return frozenset(self.dialogue_core.whitelist_users)